@@ -3,45 +3,70 @@ ninja.py - steam server browser using keywords
 """
 
 import configparser
-import ipaddress
+import json
 import os
 import re
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os.path import exists
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CLEAR         = '\033[2J\033[H'
 CONFIG_FILE   = '.ninja.ini'
 CURSOR        = '\033[?25h'
 NOCURSOR      = '\033[?25l'
-PRIVATE       = ['10.0.0.0/8','172.16.0.0/12','192.168.0.0/16']
 RESET         = bool(sys.argv[1:] and sys.argv[1].lower() == 'reset')
 SLEEP         = 60
+CHUNK_SIZE    = 65536
 TIMEOUT       = 10
+WORKERS       = 8
 ENDPOINT      = 'https://api.steampowered.com/IGameServersService/GetServerList/v1/'
-FILTER        = '?filter=\\name_match\\*##KEYWORD##*&key=##KEY##'
+DECOLOR       = re.compile(r'/\^[1-8]/')
+KEY_PATTERN   = re.compile(r'[A-Za-z0-9]{32}')
+JSON_ERRORS   = (
+    requests.exceptions.JSONDecodeError,
+    json.JSONDecodeError,
+) + ((ijson.JSONError,) if ijson else ())
 
 config = configparser.ConfigParser()
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_maxsize=WORKERS))
+
+settings = {}
 
 def api_key():
     """ get api key from config """
 
-    return config['API']['key']
+    return settings['key']
 
 def include():
     """ get include keywords from config """
 
-    return config['API']['include'].split(';')
+    return settings['include']
 
 def exclude():
-    """ get exclude keywords from config """
+    """ get exclude keyword pattern from config """
 
-    return config['API']['exclude'].split(';')
+    return settings['exclude']
 
 def private():
     """ get private network toggle from config """
 
-    return config['API'].getboolean('private')
+    return settings['private']
 
 def get_key():
     """ get the steam web api key from input """
@@ -97,22 +122,42 @@ def get_private():
     return str(key)
 
 def get_settings(cfg):
-    """ validates the settings of the config file """
+    """ validates the settings of the config file, returns True if any changed """
+
+    changed = False
 
     if not cfg.has_section('API'):
         cfg.add_section('API')
+        changed = True
 
     if RESET or not cfg.has_option('API', 'key'):
         cfg.set('API', 'key', get_key())
+        changed = True
 
     if RESET or not cfg.has_option('API', 'include'):
         cfg.set('API', 'include', get_include())
+        changed = True
 
     if RESET or not cfg.has_option('API', 'exclude'):
         cfg.set('API', 'exclude', get_exclude())
+        changed = True
 
     if RESET or not cfg.has_option('API', 'private'):
         cfg.set('API', 'private', get_private())
+        changed = True
+
+    return changed
+
+def cache_settings(cfg):
+    """ parse the config values used while polling """
+
+    settings['key'] = cfg['API']['key']
+    settings['include'] = tuple(cfg['API']['include'].split(';'))
+    keywords = [ex.strip() for ex in cfg['API']['exclude'].split(';') if ex.strip()]
+    settings['exclude'] = None
+    if keywords:
+        settings['exclude'] = re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+    settings['private'] = cfg['API'].getboolean('private')
 
 def load_config():
     """ load the config file """
@@ -120,10 +165,11 @@ def load_config():
     if exists(CONFIG_FILE):
         config.read(CONFIG_FILE)
 
-    get_settings(config)
+    if get_settings(config):
+        with open(CONFIG_FILE, 'w', encoding='ascii') as configfile:
+            config.write(configfile)
 
-    with open(CONFIG_FILE, 'w', encoding='ascii') as configfile:
-        config.write(configfile)
+    cache_settings(config)
 
 def print_line(msg):
     """ print a message with no cursor """
@@ -151,61 +197,77 @@ def red_text(text):
 def decolor(text):
     """ remove color codes from string """
 
-    return re.sub(r'/\^[1-8]/', '', text)
+    return DECOLOR.sub('', text)
 
 def clear_screen():
     """ clear the terminal screen """
 
-    os.system('cls' if os.name == 'nt' else 'clear')
+    sys.stdout.write(CLEAR)
+    sys.stdout.flush()
 
 def get_api_url(keyword):
     """ build api url """
 
-    url = ENDPOINT + FILTER
-    url = url.replace("##KEYWORD##", keyword)
-    url = url.replace("##KEY##", api_key())
+    return f'{ENDPOINT}?filter=\\name_match\\*{quote(keyword)}*&key={api_key()}'
+
+def stream_servers(response, callback):
+    """ parse servers from the response as it downloads """
+
+    found = ijson.sendable_list()
+    parser = ijson.items_coro(found, 'response.servers.item')
 
-    return url.strip()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        parser.send(chunk)
 
-def api_call(url):
-    """ makes a call to the Steam API """
+        for server in found:
+            callback(server)
+        del found[:]
+
+    parser.close()
+
+    for server in found:
+        callback(server)
+
+def api_call(url, callback):
+    """ makes a call to the Steam API, passing each server to callback """
 
-    body = None
     error = None
 
     try:
-        response = requests.get(
+        with session.get(
             url,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        body = response.json()
+            timeout=TIMEOUT,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+
+            if ijson:
+                stream_servers(response, callback)
+            else:
+                body = orjson.loads(response.content) if orjson else response.json()
+
+                if valid_response(body):
+                    for server in body['response']['servers']:
+                        callback(server)
     except requests.HTTPError as e:
         error = f'HTTPError {e.response.status_code}'
     except requests.exceptions.ConnectionError:
         error = 'ConnectionError'
     except requests.exceptions.ReadTimeout:
         error = 'ReadTimeout'
-    except requests.exceptions.JSONDecodeError:
+    except requests.exceptions.ChunkedEncodingError:
+        error = 'ChunkedEncodingError'
+    except JSON_ERRORS:
         error = 'JSONDecodeError'
     except KeyError:
         error = 'KeyError'
 
-    return body, error
+    return error
 
 def valid_key(string):
     """ Validate API Key """
 
-    if not string:
-        return False
-
-    if not len(string) == 32:
-        return False
-
-    if not string.isalnum():
-        return False
-
-    return True
+    return KEY_PATTERN.fullmatch(string) is not None
 
 def valid_response(body):
     """ Validate JSON has required keys """
@@ -224,78 +286,73 @@ def valid_response(body):
 def print_servers(servers):
     """ print a list of servers """
 
-    sort = dict(sorted(servers.items(), key=lambda x: (x[1]['game'], x[1]['name'])))
+    rows = sorted(servers, key=lambda s: (s['game'], s['name']))
 
-    ln_addr = 0
     ln_game = 0
     ln_pass = 0
     ln_name = 0
     ln_play = 0
     ln_map  = 0
 
-    for a, s in sort.items():
-        if len(a) > ln_addr:
-            ln_addr = len(a)
+    for s in rows:
+        ln_game = max(ln_game, len(s['game']))
+        ln_pass = max(ln_pass, len(s['password']))
+        ln_name = max(ln_name, len(s['name']))
+        ln_play = max(ln_play, len(s['players']))
+        ln_map  = max(ln_map, len(s['map']))
 
-        if len(s['game']) > ln_game:
-            ln_game = len(s['game'])
+    line = (
+        f'{{game:<{ln_game}}} - {{password:<{ln_pass}}}{{name:<{ln_name}}} - '
+        f'{{players:<{ln_play}}} - {{map:<{ln_map}}} - steam://connect/{{address}}'
+    )
+    lines = [line.format_map(server) for server in rows]
 
-        if len(s['password']) > ln_pass:
-            ln_pass = len(s['password'])
+    clear_screen()
+    sys.stdout.write(NOCURSOR + '\n'.join(lines) + '\n')
+    sys.stdout.flush()
 
-        if len(s['name']) > ln_name:
-            ln_name = len(s['name'])
+def private_network(ip):
+    """ is IP in a private network range (10/8, 172.16/12, 192.168/16) """
 
-        if len(s['players']) > ln_play:
-            ln_play = len(s['players'])
+    if ip.startswith(('10.', '192.168.')):
+        return True
 
-        if len(s['map']) > ln_map:
-            ln_map = len(s['map'])
+    if ip.startswith('172.'):
+        return 16 <= int(ip.split('.', 2)[1]) <= 31
 
-    clear_screen()
+    return False
 
-    for address, server in sort.items():
-        line = ''
-        line += server['game'].ljust(ln_game)
-        line += ' - '
-        line += server['password'].ljust(ln_pass)
-        line += server['name'].ljust(ln_name)
-        line += ' - '
-        line += server['players'].ljust(ln_play)
-        line += ' - '
-        line += server['map'].ljust(ln_map)
-        line += ' - '
-        line += f'steam://connect/{address}'
-
-        print_line(line)
+def excluded(name):
+    """ does name contain an exclude keyword """
 
-def private_network(ip):
-    """ is IP in a private network range """
+    pattern = exclude()
 
-    for network in PRIVATE:
-        if ipaddress.IPv4Address(ip) in ipaddress.IPv4Network(network):
-            return True
+    return bool(pattern and pattern.search(name))
 
-    return False
+def join_address(server_json):
+    """ build the ip:gameport address used to join a server """
+
+    ip = server_json['addr'].strip().split(':')[0].strip()
+
+    return f"{ip}:{server_json['gameport']}"
 
 def create_server(server_json):
     """ create server dictionary from json """  
 
-    name = decolor(server_json['name'].strip())
+    name = server_json['name'].strip()
 
-    if exclude()[0] and any(ex.lower().strip() in name.lower() for ex in exclude()):
+    if '/^' in name:
+        name = decolor(name)
+
+    if excluded(name):
         return None
 
-    addr        = server_json['addr'].strip()
-    address     = addr.split(':')
-    ip          = address[0].strip()
+    join_addr   = join_address(server_json)
+    ip          = join_addr.rpartition(':')[0]
 
     if not private() and private_network(ip):
         return None
 
-    gameport    = server_json['gameport']
-    join_addr   = f'{ip}:{gameport}'
-
     product     = server_json['product'].strip()
     map_name    = decolor(server_json['map'].strip())
 
@@ -318,38 +375,53 @@ def create_server(server_json):
         'address': join_addr 
     }
 
-def get_servers(keyword):
-    """ get servers by keyword """    
+def get_servers(keyword, seen):
+    """ get servers by keyword, reusing servers already built in seen """    
     servers = {}
 
-    url = get_api_url(keyword)
-    body, error = api_call(url)
+    def add_server(server):
+        addr = join_address(server)
+        if addr not in seen:
+            seen[addr] = create_server(server)
 
-    if error:
-        print_line(red_text(f'ERROR: {error}'))
-        time.sleep(SLEEP)
+        server_dict = seen[addr]
+        if server_dict:
+            servers[addr] = server_dict
 
-    if not valid_response(body):
-        return servers
+    url = get_api_url(keyword)
+    error = api_call(url, add_server)
 
-    for server in body['response']['servers']:
-        server_dict = create_server(server)
-        if server_dict:
-            servers[server_dict['address']] = server_dict
+    if error:
+        return {}, error
 
-    return servers
+    return servers, error
 
 def run():
     """ run the server browser """
 
-    while True:
-        servers = {}
+    keywords = include()
+
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(keywords))) as executor:
+        while True:
+            servers = {}
+            failed = False
+            seen = {}
+
+            for result, error in executor.map(partial(get_servers, seen=seen), keywords):
+                servers.update(result)
+
+                if error:
+                    print_line(red_text(f'ERROR: {error}'))
+                    failed = True
+
+            if failed:
+                time.sleep(SLEEP)
 
-        for keyword in include():
-            servers.update(get_servers(keyword))
+            print_servers(servers.values())
+            time.sleep(SLEEP)
 
-        print_servers(servers)
-        time.sleep(SLEEP)
+if os.name == 'nt':
+    os.system('') # enables ANSI escape sequences in the windows console
 
 load_config()
 clear_screen()